@@ -1,3 +1,4 @@
+import os
 import time
 import numpy as np
 import mido
@@ -5,32 +6,64 @@ import tensorflow as tf
 import fluidsynth
 import argparse
 
-from config import BASS_LOWEST_PITCH, CHORD_VECTOR_SIZE, NOTE_VOCAB_SIZE, REST_TOKEN
-from models import build_unrolled_model, build_single_step_model
-
-def sample_note(prob_dist, temperature=1.0):
-    """Randomly sample a note token from a probability distribution."""
-    log_dist = np.log(prob_dist + 1e-9) / temperature
-    exp_dist = np.exp(log_dist)
-    softmax_dist = exp_dist / np.sum(exp_dist)
-    return np.random.choice(range(len(prob_dist)), p=softmax_dist)
+from config import BASS_LOWEST_PITCH, GUITAR_LOWEST_PITCH, CHORD_VECTOR_SIZE, NOTE_VOCAB_SIZE, REST_TOKEN
+from models import build_unrolled_model, build_single_step_model, convert_single_step_to_tflite
 
 def main(args):
     WEIGHTS_PATH = "./saved_models/unrolled_lstm.weights.h5"
-    
-    # 1. Model Setup: Build unrolled model, load weights, then build single-step model and copy weights.
-    unrolled_model = build_unrolled_model()
-    unrolled_model.load_weights(WEIGHTS_PATH)
-    
-    rt_model = build_single_step_model()
-    for rt_layer in rt_model.layers:
-        try:
-            source_layer = unrolled_model.get_layer(rt_layer.name)
-            rt_layer.set_weights(source_layer.get_weights())
-            print(f"Copied weights for layer '{rt_layer.name}'")
-        except Exception as e:
-            print(f"Skipping layer '{rt_layer.name}'")
-    rt_model.get_layer("lstm").reset_states()
+    TFLITE_PATH = "./saved_models/rt_int8.tflite"
+
+    # 1. Model Setup: prefer the int8 model exported by train.py. Otherwise build
+    # the unrolled model, load weights, copy them into the single-step model and
+    # convert that to TFLite; Keras .predict() carries far more per-call overhead
+    # than the model itself costs. The LSTM state lives in resource variables, so
+    # it persists across invoke() calls like the Keras model.
+    if os.path.exists(TFLITE_PATH):
+        print(f"Loading int8 real-time model from {TFLITE_PATH}")
+        interp = tf.lite.Interpreter(model_path=TFLITE_PATH, num_threads=1)
+    else:
+        unrolled_model = build_unrolled_model()
+        unrolled_model.load_weights(WEIGHTS_PATH)
+
+        rt_model = build_single_step_model()
+        for rt_layer in rt_model.layers:
+            try:
+                source_layer = unrolled_model.get_layer(rt_layer.name)
+                rt_layer.set_weights(source_layer.get_weights())
+                print(f"Copied weights for layer '{rt_layer.name}'")
+            except Exception as e:
+                print(f"Skipping layer '{rt_layer.name}'")
+        rt_model.get_layer("lstm").reset_states()
+
+        interp = tf.lite.Interpreter(model_content=convert_single_step_to_tflite(rt_model),
+                                     num_threads=1)
+    interp.allocate_tensors()
+
+    # Cache tensor indices outside the loop.
+    input_details = {d['name']: d['index'] for d in interp.get_input_details()}
+    note_idx = next(i for name, i in input_details.items() if 'notes_in_rt' in name)
+    chord_idx = next(i for name, i in input_details.items() if 'chords_in_rt' in name)
+    temp_idx = next(i for name, i in input_details.items() if 'temperature' in name)
+    token_idx = next(d['index'] for d in interp.get_output_details()
+                     if d['dtype'] == np.int32)
+
+    # Held notes as a bitmask (bit i = pitch GUITAR_LOWEST_PITCH + i, the same
+    # columns as the training chords), decoded into the multi-hot chord vector
+    # once per step.
+    chord_mask = 0
+    chord_bits = np.left_shift(np.uint64(1), np.arange(CHORD_VECTOR_SIZE, dtype=np.uint64))
+
+    def on_midi(msg):
+        """Update the chord mask from mido's input thread as messages arrive."""
+        nonlocal chord_mask
+        if msg.type != 'note_on' and msg.type != 'note_off':
+            return
+        idx = msg.note - GUITAR_LOWEST_PITCH
+        if 0 <= idx < CHORD_VECTOR_SIZE:
+            if msg.type == 'note_on' and msg.velocity > 0:
+                chord_mask |= 1 << idx
+            else:
+                chord_mask &= ~(1 << idx)
 
     # 2. Setup MIDI Input
     input_ports = mido.get_input_names()
@@ -59,7 +92,7 @@ def main(args):
     
     try:
         port_name = input_ports[port_index]
-        inport = mido.open_input(port_name)
+        inport = mido.open_input(port_name, callback=on_midi)
         print(f"Listening for MIDI on: '{port_name}'")
     except IndexError:
         print(f"Error: MIDI port {port_index} not found.")
@@ -82,55 +115,71 @@ def main(args):
     fs.program_select(0, sfid, 0, 0)
     fs.setting('synth.gain', 1.5)
 
-    # Initialize the chord vector (multi-hot), length = CHORD_VECTOR_SIZE.
-    chord_vector = np.zeros((CHORD_VECTOR_SIZE,), dtype=np.float32)
     step_interval = 0.15  # Interval between note generation
+    spin_time = 0.001     # Busy-wait the final stretch before each deadline
+
+    # MIDI pitch for every token, with REST mapped to -1 (silent).
+    token_to_midi = np.arange(NOTE_VOCAB_SIZE, dtype=np.int32) + BASS_LOWEST_PITCH
+    token_to_midi[REST_TOKEN] = -1
 
     current_note = REST_TOKEN  # Start with REST
-    last_played_note = None  # To track currently played note
+    last_pitch = -1  # MIDI pitch currently sounding, -1 when silent
 
     print("Starting real-time generation with MIDI input and FluidSynth output.")
     print("Press Ctrl+C to stop.")
-    
+
+    # Warm up right before the first real step, once the port and synth are
+    # ready, so no idle gap follows it; the first invocations run several
+    # times slower than steady state. Feeding REST and silence is the same as
+    # the loop having started a moment earlier with nobody playing.
+    rest_input = np.array([[REST_TOKEN]], dtype=np.int32)
+    silence_input = np.zeros((1, 1, CHORD_VECTOR_SIZE), dtype=np.float32)
+    # The model samples the next note itself; temperature is fixed for the run.
+    interp.set_tensor(temp_idx, np.array(args.temperature, dtype=np.float32))
+    for _ in range(20):
+        interp.set_tensor(note_idx, rest_input)
+        interp.set_tensor(chord_idx, silence_input)
+        interp.invoke()
+
+    next_deadline = time.monotonic()
     try:
         while True:
-            # 4. Update the chord vector from incoming MIDI messages.
-            for msg in inport.iter_pending():
-                if msg.type == 'note_on' and msg.velocity > 0:
-                    idx = msg.note - BASS_LOWEST_PITCH
-                    if 0 <= idx < CHORD_VECTOR_SIZE:
-                        chord_vector[idx] = 1.0
-                elif msg.type == 'note_off' or (msg.type == 'note_on' and msg.velocity == 0):
-                    idx = msg.note - BASS_LOWEST_PITCH
-                    if 0 <= idx < CHORD_VECTOR_SIZE:
-                        chord_vector[idx] = 0.0
-
-            # 5. Generate next note using the current chord vector.
-            chord_input = chord_vector.reshape((1, 1, CHORD_VECTOR_SIZE))
+            # 4. Generate next note using the current chord, which the MIDI
+            # callback keeps up to date between steps.
+            mask = chord_mask
+            chord_input = ((np.uint64(mask) & chord_bits) != 0).astype(np.float32)
+            chord_input = chord_input.reshape((1, 1, CHORD_VECTOR_SIZE))
             note_input = np.array([[current_note]], dtype=np.int32)
-            preds, _, _ = rt_model.predict([note_input, chord_input], verbose=0)
-            preds = preds[0]  # shape: (NOTE_VOCAB_SIZE,)
-            next_note = sample_note(preds, temperature=args.temperature)
-
-            # If next_note is the same as last_played_note, sustain it
-            if next_note != last_played_note:
-                # Turn off the last played note if it's different
-                if last_played_note is not None and last_played_note != REST_TOKEN:
-                    fs.noteoff(0, last_played_note + BASS_LOWEST_PITCH)
-                
-                # Play new note if it's not a rest
-                if next_note != REST_TOKEN:
-                    midi_pitch = next_note + BASS_LOWEST_PITCH
-                    fs.noteon(0, midi_pitch, 64)
-
-                # Update last played note
-                last_played_note = next_note
+            interp.set_tensor(note_idx, note_input)
+            interp.set_tensor(chord_idx, chord_input)
+            interp.invoke()
+            next_note = int(interp.get_tensor(token_idx)[0, 0])
+
+            # If the pitch is unchanged, sustain it; otherwise release the old
+            # pitch and strike the new one (-1 means silent on either side).
+            new_pitch = int(token_to_midi[next_note])
+            if new_pitch != last_pitch:
+                if last_pitch >= 0:
+                    fs.noteoff(0, last_pitch)
+                if new_pitch >= 0:
+                    fs.noteon(0, new_pitch, 64)
+                last_pitch = new_pitch
 
             # Update the current note for the next step
             current_note = next_note
 
-            # Wait until next step.
-            time.sleep(step_interval)
+            # Wait until the next step's absolute deadline, so time spent on
+            # inference does not accumulate as drift.
+            next_deadline += step_interval
+            delay = next_deadline - time.monotonic()
+            if delay > 0:
+                if delay > spin_time:
+                    time.sleep(delay - spin_time)
+                while time.monotonic() < next_deadline:
+                    pass
+            else:
+                print(f"Step overran its deadline by {-delay * 1000:.1f} ms")
+                next_deadline = time.monotonic()
     except KeyboardInterrupt:
         print("Real-time generation stopped by user.")
     finally:
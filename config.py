@@ -31,4 +31,5 @@ LSTM_UNITS       = 64
 # ─────────────——— TRAINING ————───────── #
 BATCH_SIZE   = 32
 EPOCHS       = 15
+VALIDATION_SPLIT = 0.1          # trailing fraction of windows held out
 LEARNING_RATE = 0.001
@@ -1,6 +1,9 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pretty_midi
+from numba import njit
 from tqdm import tqdm
 
 from config import (
@@ -8,7 +11,7 @@ from config import (
     SEQUENCE_LENGTH,
     # pitch constants
     BASS_LOWEST_PITCH, BASS_HIGHEST_PITCH, BASS_REST_TOKEN,
-    GUITAR_LOWEST_PITCH, GUITAR_HIGHEST_PITCH, CHORD_VECTOR_SIZE,
+    GUITAR_LOWEST_PITCH, CHORD_VECTOR_SIZE,
     STEPS_PER_QUARTER, DEFAULT_BPM
 )
 
@@ -37,136 +40,206 @@ def extract_bass_and_guitar_tracks(midi_path):
 
 # ───────────────────────── QUANTISATION ───────────────────────── #
 
-def quantize_bass_to_array(inst, steps_per_quarter=4, default_bpm=120):
-    """Monophonic bass → 1‑D token array (REST_TOKEN when silent)."""
-    if not inst.notes:
-        return np.array([], dtype=np.int32)
+def _note_arrays(inst):
+    """Return (starts, ends, pitches) arrays, one entry per note."""
+    starts  = np.fromiter((n.start for n in inst.notes), dtype=np.float64)
+    ends    = np.fromiter((n.end   for n in inst.notes), dtype=np.float64)
+    pitches = np.fromiter((n.pitch for n in inst.notes), dtype=np.int32)
+    return starts, ends, pitches
+
 
+def _note_events(inst):
+    """Return (times, pitches, is_on, note_ids) arrays of note on/off events
+    in time order; note_ids index inst.notes."""
+    starts, ends, pitches = _note_arrays(inst)
+
+    times = np.concatenate((starts, ends))
+    order = np.argsort(times, kind='stable')     # ties: note‑ons before note‑offs
+    return (times[order],
+            np.concatenate((pitches, pitches))[order],
+            (order < len(starts)),
+            order % len(starts))
+
+
+def _step_grid(inst, steps_per_quarter, default_bpm):
+    """Return (step_dur, total_steps) covering every note of `inst`."""
     max_end = max(n.end for n in inst.notes)
     step_dur = (120 / default_bpm) / steps_per_quarter
-    total_steps = int(np.ceil(max_end / step_dur))
-
-    events = [(n.start, n.pitch, True) for n in inst.notes] + \
-             [(n.end,   n.pitch, False) for n in inst.notes]
-    events.sort(key=lambda x: x[0])
-
-    out = np.full(total_steps, BASS_REST_TOKEN, dtype=np.int32)
-    current = BASS_REST_TOKEN
-    e_idx = 0
-
-    for s in range(total_steps):
-        t = s * step_dur
-        while e_idx < len(events) and events[e_idx][0] <= t:
-            _, p, on = events[e_idx]
-            current = p if on else (BASS_REST_TOKEN if p == current else current)
-            e_idx += 1
-
-        if (current != BASS_REST_TOKEN and
-            BASS_LOWEST_PITCH <= current <= BASS_HIGHEST_PITCH):
-            out[s] = current - BASS_LOWEST_PITCH
+    return step_dur, int(np.ceil(max_end / step_dur))
+
+
+@njit(cache=True)
+def _bass_event_pitches(pitches, is_on, note_ids):
+    """Sounding pitch after each event (‑1 = silent). Only the note‑off of
+    the note currently sounding silences it, so a note re‑struck as the
+    previous one of the same pitch ends keeps sounding."""
+    out = np.empty(len(pitches), dtype=np.int32)
+    current = -1
+    current_id = -1
+    for e in range(len(pitches)):
+        if is_on[e]:
+            current = pitches[e]
+            current_id = note_ids[e]
+        elif note_ids[e] == current_id:
+            current = -1
+            current_id = -1
+        out[e] = current
     return out
 
 
-def quantize_guitar_to_chord_array(inst, steps_per_quarter=4, default_bpm=120):
-    """Polyphonic guitar → (time, CHORD_VECTOR_SIZE) multi‑hot array."""
+def bass_pitch_array(inst, steps_per_quarter=4, default_bpm=120):
+    """Monophonic bass → 1‑D array of the sounding MIDI pitch (‑1 when silent)."""
     if not inst.notes:
-        return np.zeros((0, CHORD_VECTOR_SIZE), dtype=np.float32)
+        return np.array([], dtype=np.int32)
 
-    max_end = max(n.end for n in inst.notes)
-    step_dur = (120 / default_bpm) / steps_per_quarter
-    total_steps = int(np.ceil(max_end / step_dur))
-
-    events = [(n.start, n.pitch, True) for n in inst.notes] + \
-             [(n.end,   n.pitch, False) for n in inst.notes]
-    events.sort(key=lambda x: x[0])
-
-    out = np.zeros((total_steps, CHORD_VECTOR_SIZE), dtype=np.float32)
-    active = set()
-    e_idx = 0
-
-    for s in range(total_steps):
-        t = s * step_dur
-        while e_idx < len(events) and events[e_idx][0] <= t:
-            _, p, on = events[e_idx]
-            (active.add if on else active.discard)(p)
-            e_idx += 1
-
-        for p in active:
-            if GUITAR_LOWEST_PITCH <= p <= GUITAR_HIGHEST_PITCH:
-                idx = p - GUITAR_LOWEST_PITCH
-                out[s, idx] = 1.0
-    return out
+    step_dur, total_steps = _step_grid(inst, steps_per_quarter, default_bpm)
+    times, pitches, is_on, note_ids = _note_events(inst)
+    current = _bass_event_pitches(pitches, is_on, note_ids)
+
+    # Each step holds the pitch left by the last event at or before it.
+    grid = np.arange(total_steps) * step_dur
+    last = np.searchsorted(times, grid, side='right') - 1
+    return np.where(last >= 0, current[last], -1).astype(np.int32)
+
+
+def bass_pitches_to_tokens(pitch_arr, transpose=0):
+    """Key‑shift a `bass_pitch_array` and map it to tokens (REST_TOKEN when
+    silent or out of range)."""
+    p = pitch_arr + transpose
+    valid = (pitch_arr >= 0) & (p >= BASS_LOWEST_PITCH) & (p <= BASS_HIGHEST_PITCH)
+    return np.where(valid, p - BASS_LOWEST_PITCH, BASS_REST_TOKEN).astype(np.int32)
+
+
+def quantize_bass_to_array(inst, steps_per_quarter=4, default_bpm=120):
+    """Monophonic bass → 1‑D token array (REST_TOKEN when silent)."""
+    return bass_pitches_to_tokens(
+        bass_pitch_array(inst, steps_per_quarter, default_bpm))
+
+
+def quantize_guitar_to_chord_array(inst, steps_per_quarter=4, default_bpm=120,
+                                   lowest_pitch=GUITAR_LOWEST_PITCH,
+                                   size=CHORD_VECTOR_SIZE):
+    """Polyphonic guitar → (time, size) multi‑hot array, column 0 = lowest_pitch."""
+    if not inst.notes:
+        return np.zeros((0, size), dtype=np.float32)
+
+    step_dur, total_steps = _step_grid(inst, steps_per_quarter, default_bpm)
+
+    starts, ends, pitches = _note_arrays(inst)
+    idx  = pitches - lowest_pitch
+    keep = (idx >= 0) & (idx < size)
+    idx  = idx[keep]
+
+    # A note is active from the first step at or after its start until the
+    # first step at or after its end, so the chord is a running sum of ±1s.
+    grid       = np.arange(total_steps) * step_dur
+    start_step = np.searchsorted(grid, starts[keep], side='left')
+    end_step   = np.searchsorted(grid, ends[keep],   side='left')
+
+    delta = np.zeros((total_steps + 1, size), dtype=np.int32)
+    np.add.at(delta, (start_step, idx), 1)
+    np.add.at(delta, (end_step,   idx), -1)
+    return (np.cumsum(delta[:total_steps], axis=0) > 0).astype(np.float32)
 
 # ───────────────────────── PARSER ───────────────────────── #
 
-def parse_midi_file(midi_path, transpose=0):
-    """Return (bass_tokens, guitar_chords)."""
+def parse_midi_file_transposed(midi_path, transposes=(0,)):
+    """
+    Return [(bass_tokens, guitar_chords), ...], one pair per key shift in
+    `transposes`. The file is parsed and quantised once; each shift offsets
+    the bass pitches and slices a chord array widened by the largest shifts.
+    """
     bass, git = extract_bass_and_guitar_tracks(midi_path)
+    up   = max(0, max(transposes))
+    down = max(0, -min(transposes))
 
-    if transpose:
-        for inst in (bass, git):
-            for n in inst.notes:
-                n.pitch += transpose
-
-    bass_arr   = quantize_bass_to_array(
+    pitch_arr   = bass_pitch_array(
         bass, steps_per_quarter=STEPS_PER_QUARTER, default_bpm=DEFAULT_BPM)
-    chord_arr  = quantize_guitar_to_chord_array(
-        git,  steps_per_quarter=STEPS_PER_QUARTER, default_bpm=DEFAULT_BPM)
+    wide_chords = quantize_guitar_to_chord_array(
+        git,  steps_per_quarter=STEPS_PER_QUARTER, default_bpm=DEFAULT_BPM,
+        lowest_pitch=GUITAR_LOWEST_PITCH - up,
+        size=CHORD_VECTOR_SIZE + up + down)
 
     # pad to equal length
-    L = max(len(bass_arr), len(chord_arr))
-    if len(bass_arr)  < L:
-        bass_arr  = np.pad(bass_arr,  (0, L-len(bass_arr)),  constant_values=BASS_REST_TOKEN)
-    if len(chord_arr) < L:
-        chord_arr = np.pad(chord_arr, ((0, L-len(chord_arr)), (0, 0)))
+    L = max(len(pitch_arr), len(wide_chords))
+    if len(pitch_arr)   < L:
+        pitch_arr   = np.pad(pitch_arr,   (0, L-len(pitch_arr)),  constant_values=-1)
+    if len(wide_chords) < L:
+        wide_chords = np.pad(wide_chords, ((0, L-len(wide_chords)), (0, 0)))
 
-    return bass_arr, chord_arr
+    # Shifting by k moves original pitch q to column q + k - GUITAR_LOWEST_PITCH.
+    return [(bass_pitches_to_tokens(pitch_arr, k),
+             wide_chords[:, up-k : up-k+CHORD_VECTOR_SIZE])
+            for k in transposes]
+
+
+def parse_midi_file(midi_path, transpose=0):
+    """Return (bass_tokens, guitar_chords)."""
+    return parse_midi_file_transposed(midi_path, (transpose,))[0]
 
 # ───────────────────────── WINDOW SLICING ───────────────────────── #
 
 def slice_into_windows(bass_arr, chord_arr, T=SEQUENCE_LENGTH):
-    """Return (X_notes, X_chords, y_notes) for one song."""
+    """Return (X_notes, X_chords, y_notes) for one song as read‑only views."""
     L = len(bass_arr)
     if L < T:
         return None, None, None
 
-    Xn, Xc, Yn = [], [], []
-    for i in range(0, L - T, T):
-        Xn.append(bass_arr[i       : i+T-1])
-        Xc.append(chord_arr[i      : i+T-1, :])
-        Yn.append(bass_arr[i+1     : i+T])
-    if not Xn:
+    nw = len(range(0, L - T, T))
+    if nw == 0:
         return None, None, None
 
-    return (np.asarray(Xn, dtype=np.int32),
-            np.asarray(Xc, dtype=np.float32),
-            np.asarray(Yn, dtype=np.int32))
+    # Disjoint length‑T windows starting every T steps; no data is copied.
+    bw = sliding_window_view(bass_arr, T)[::T][:nw]                  # (nw, T)
+    cw = sliding_window_view(chord_arr, T, axis=0)[::T][:nw]         # (nw, C, T)
+    cw = cw.transpose(0, 2, 1)                                       # (nw, T, C)
+
+    return bw[:, :T-1], cw[:, :T-1, :], bw[:, 1:T]
 
 # ───────────────────────── DATASET BUILDER ───────────────────────── #
 
+def parse_and_slice(path, transposes, T=SEQUENCE_LENGTH):
+    """Worker: parse one file, key‑shift it → list of (Xn, Xc, Yn) windows."""
+    try:
+        songs = parse_midi_file_transposed(path, transposes)
+    except Exception as e:
+        print(f"{path}: {e}")
+        return []
+
+    windows = []
+    for bass, chords in songs:
+        if bass.size == 0:
+            continue
+        Xn, Xc, Yn = slice_into_windows(bass, chords, T)
+        if Xn is not None:
+            windows.append((Xn, Xc, Yn))
+    return windows
+
+
 def build_training_dataset(folder=MIDI_FOLDER,
                            T=SEQUENCE_LENGTH,
-                           transpose_range=(-6, 7)):
+                           transpose_range=(-6, 7),
+                           max_workers=None):
     """Walk folder, augment by key‑shift, assemble full dataset."""
     Xn_all, Xc_all, Yn_all = [], [], []
 
     midi_files = [os.path.join(folder, f)
                   for f in os.listdir(folder)
                   if f.lower().endswith('.mid')]
-
-    for path in tqdm(midi_files, desc="Processing MIDI"):
-        for k in range(*transpose_range):
-            try:
-                bass, chords = parse_midi_file(path, transpose=k)
-                if bass.size == 0:
-                    continue
-                Xn, Xc, Yn = slice_into_windows(bass, chords, T)
-                if Xn is not None:
-                    Xn_all.append(Xn)
-                    Xc_all.append(Xc)
-                    Yn_all.append(Yn)
-            except Exception as e:
-                print(f"{path} (+{k}): {e}")
+    transposes = tuple(range(*transpose_range))
+
+    # Files are independent; results come back in file order.
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+        results = pool.map(parse_and_slice,
+                           midi_files,
+                           [transposes] * len(midi_files),
+                           [T] * len(midi_files),
+                           chunksize=4)
+        for windows in tqdm(results, total=len(midi_files), desc="Processing MIDI"):
+            for Xn, Xc, Yn in windows:
+                Xn_all.append(Xn)
+                Xc_all.append(Xc)
+                Yn_all.append(Yn)
 
     if not Xn_all:
         return None, None, None
@@ -1,5 +1,7 @@
 # models.py
 
+import tempfile
+
 import tensorflow as tf
 from tensorflow.keras import layers, Model
 
@@ -102,12 +104,14 @@ def build_single_step_model():
     # Concatenate the note and chord processing streams
     combined_rt = layers.Concatenate(axis=-1)([note_embed_rt, chord_dense_rt])
     
-    # Stateful LSTM processes one timestep
+    # Stateful LSTM processes one timestep. Unrolling the single step lets the
+    # TFLite converter emit the cell ops inline instead of a WHILE subgraph.
     lstm_layer_rt = layers.LSTM(
         LSTM_UNITS,
         stateful=True,
         return_sequences=False,
         return_state=True,
+        unroll=True,
         name="lstm"
     )
     lstm_out_rt, state_h_rt, state_c_rt = lstm_layer_rt(combined_rt)
@@ -133,3 +137,33 @@ def build_single_step_model():
         loss='sparse_categorical_crossentropy'
     )
     return rt_model
+
+def convert_single_step_to_tflite(rt_model, optimizations=()):
+    """
+    Convert the real-time model to a TFLite flatbuffer with sampling built in.
+    Inputs: notes_in_rt (1, 1), chords_in_rt (1, 1, chord_vec), temperature ().
+    Outputs: sampled token (1, 1) int32, note probabilities and both LSTM states.
+    The LSTM state stays in resource variables and persists across invocations.
+    """
+    def step_and_sample(notes_in, chords_in, temperature):
+        probs, state_h, state_c = rt_model([notes_in, chords_in], training=False)
+        logits = tf.math.log(probs + 1e-9) / temperature
+        token = tf.random.categorical(logits, 1, dtype=tf.int32)
+        return token, probs, state_h, state_c
+
+    archive = tf.keras.export.ExportArchive()
+    archive.track(rt_model)
+    archive.add_endpoint(
+        "serve",
+        step_and_sample,
+        input_signature=[
+            tf.TensorSpec((1, 1), tf.int32, name="notes_in_rt"),
+            tf.TensorSpec((1, 1, CHORD_VECTOR_SIZE), tf.float32, name="chords_in_rt"),
+            tf.TensorSpec((), tf.float32, name="temperature")
+        ]
+    )
+    with tempfile.TemporaryDirectory() as export_dir:
+        archive.write_out(export_dir)
+        converter = tf.lite.TFLiteConverter.from_saved_model(export_dir)
+        converter.optimizations = list(optimizations)
+        return converter.convert()
@@ -19,19 +19,12 @@ from config import (                # keep one source of truth
     REST_TOKEN,
     GUITAR_LOWEST_PITCH,
     STEPS_PER_QUARTER,
-    BASS_LOWEST_PITCH
+    BASS_LOWEST_PITCH,
+    CHORD_VECTOR_SIZE
 )
 
 WEIGHTS_PATH = "./saved_models/unrolled_lstm.weights.h5"
 
-# ───────────────────────── SAMPLING ───────────────────────── #
-
-def sample_note(prob_dist, temperature=1.0):
-    """Temperature‑controlled sampling from a probability distribution."""
-    logp = np.log(prob_dist + 1e-9) / temperature
-    p    = np.exp(logp) / np.sum(np.exp(logp))
-    return np.random.choice(len(prob_dist), p=p)
-
 # ───────────────────────── MIDI HELPERS ───────────────────────── #
 
 def chord_array_to_midi_instrument(
@@ -47,34 +40,24 @@ def chord_array_to_midi_instrument(
     beat_dur = tempo_us_per_beat / 1_000_000.0
     step     = beat_dur / STEPS_PER_QUARTER
 
-    active = tuple()          # current active idx tuple
-    start  = 0.0
-
-    for t, frame in enumerate(chord_array):
-        idx_now = tuple(np.where(frame > 0.5)[0])
-        if idx_now != active:           # chord change
-            if active:                  # finish previous chord
-                for idx in active:
-                    pitch = idx + GUITAR_LOWEST_PITCH
-                    inst.notes.append(
-                        pretty_midi.Note(velocity=90,
-                                         pitch=pitch,
-                                         start=start,
-                                         end=t*step)
-                    )
-            active, start = idx_now, t*step
-
-    # close final chord
-    end_time = len(chord_array) * step
-    if active:
-        for idx in active:
-            pitch = idx + GUITAR_LOWEST_PITCH
-            inst.notes.append(
-                pretty_midi.Note(velocity=90,
-                                 pitch=pitch,
-                                 start=start,
-                                 end=end_time)
-            )
+    if len(chord_array) == 0:
+        return inst
+
+    # Segment boundaries are the frames where the chord changes.
+    on      = np.asarray(chord_array) > 0.5
+    changes = np.concatenate(([True], np.any(on[1:] != on[:-1], axis=1), [True]))
+    bounds  = np.flatnonzero(changes)
+
+    seg_start = (bounds[:-1] * step).tolist()
+    seg_end   = (bounds[1:]  * step).tolist()
+    seg_idx   = [np.flatnonzero(on[a]).tolist() for a in bounds[:-1]]
+
+    inst.notes = [pretty_midi.Note(velocity=90,
+                                   pitch=idx + GUITAR_LOWEST_PITCH,
+                                   start=start,
+                                   end=end)
+                  for start, end, idxs in zip(seg_start, seg_end, seg_idx)
+                  for idx in idxs]
     return inst
 
 
@@ -88,26 +71,23 @@ def tokens_to_bass_instrument(tokens,
     beat_dur = tempo_us_per_beat / 1_000_000.0
     step     = beat_dur / STEPS_PER_QUARTER
 
-    t = 0
-    while t < len(tokens):
-        tok = tokens[t]
-        if tok == REST_TOKEN:
-            t += 1
-            continue
-
-        # count how long the same note lasts
-        start = t
-        while t < len(tokens) and tokens[t] == tok:
-            t += 1
-        end = t
-
-        pitch = tok + BASS_LOWEST_PITCH
-        inst.notes.append(
-            pretty_midi.Note(velocity=100,
-                             pitch=pitch,
-                             start=start*step,
-                             end=end*step)
-        )
+    tokens = np.asarray(tokens)
+    if len(tokens) == 0:
+        return inst
+
+    # Runs of identical tokens become single notes; REST runs are skipped.
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(tokens)) + 1, [len(tokens)]))
+
+    starts, ends = bounds[:-1], bounds[1:]
+    keep = tokens[starts] != REST_TOKEN
+
+    inst.notes = [pretty_midi.Note(velocity=100,
+                                   pitch=tok + BASS_LOWEST_PITCH,
+                                   start=start,
+                                   end=end)
+                  for tok, start, end in zip(tokens[starts[keep]].tolist(),
+                                             (starts[keep] * step).tolist(),
+                                             (ends[keep]   * step).tolist())]
     return inst
 
 # ───────────────────────── MAIN PIPELINE ───────────────────────── #
@@ -140,16 +120,27 @@ def add_generated_bass_to_midi(input_midi, output_midi, temperature=1.0):
             pass
     rt.get_layer("lstm").reset_states()
 
-    # 3. Autoregressive generation
-    generated = []
-    prev_tok  = REST_TOKEN
-    for t in range(steps):
-        chord_vec = chord_arr[t].reshape(1, 1, -1).astype(np.float32)
-        note_in   = np.array([[prev_tok]], dtype=np.int32)
-        pred, _, _ = rt.predict([note_in, chord_vec], verbose=0)
-        next_tok   = sample_note(pred[0], temperature)
-        generated.append(next_tok)
-        prev_tok = next_tok
+    # 3. Autoregressive generation, run entirely inside one traced graph so
+    # the song costs a single call rather than one dispatch per frame.
+    # Sampling matches temperature‑scaled log‑probabilities, done in‑graph.
+    @tf.function(input_signature=[
+        tf.TensorSpec((None, CHORD_VECTOR_SIZE), tf.float32),
+        tf.TensorSpec((), tf.float32)
+    ])
+    def generate(chords, temperature):
+        n_steps = tf.shape(chords)[0]
+        tokens  = tf.TensorArray(tf.int32, size=n_steps)
+        prev    = tf.constant([[REST_TOKEN]], dtype=tf.int32)
+        for t in tf.range(n_steps):
+            chord_vec  = tf.reshape(chords[t], (1, 1, CHORD_VECTOR_SIZE))
+            pred, _, _ = rt([prev, chord_vec], training=False)
+            logits     = tf.math.log(pred + 1e-9) / temperature
+            prev       = tf.cast(tf.random.categorical(logits, 1), tf.int32)
+            tokens     = tokens.write(t, prev[0, 0])
+        return tokens.stack()
+
+    generated = generate(chord_arr.astype(np.float32),
+                         tf.constant(temperature, dtype=tf.float32)).numpy()
 
     # 4. Build output MIDI
     tempo = 500000          # 120 BPM; adjust if desired
@@ -10,25 +10,61 @@ from config import (
     SEQUENCE_LENGTH,
     BATCH_SIZE,
     EPOCHS,
+    VALIDATION_SPLIT,
 )
 
 from data_preparation import build_training_dataset
-from models import build_unrolled_model, build_single_step_model
+from models import build_unrolled_model, build_single_step_model, convert_single_step_to_tflite
 
 def sample_note(prob_dist, temperature=1.1):
     """Randomly sample a note token from a probability distribution."""
-    log_dist = np.log(prob_dist + 1e-9) / temperature
-    exp_dist = np.exp(log_dist)
-    softmax_dist = exp_dist / np.sum(exp_dist)
-    return np.random.choice(range(len(prob_dist)), p=softmax_dist)
+    if temperature == 1.0:
+        weights = prob_dist  # already a distribution
+    else:
+        log_dist = np.log(prob_dist + 1e-9) * (1.0 / temperature)
+        weights = np.exp(log_dist - log_dist.max())
+    cdf = np.cumsum(weights)
+    return int(np.searchsorted(cdf, np.random.random() * cdf[-1], side='right'))
+
+class WindowBatches(tf.keras.utils.PyDataset):
+    """
+    Batches of ((X_notes, X_chords), y_notes) gathered from the rows in
+    `indices`. Only the rows of the current batch are read, so memory-mapped
+    arrays stay on disk instead of being copied into a tensor up front.
+    """
+    def __init__(self, X_notes, X_chords, y_notes, indices, batch_size, shuffle=False):
+        super().__init__()
+        self.X_notes = X_notes
+        self.X_chords = X_chords
+        self.y_notes = y_notes
+        self.indices = np.array(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        if shuffle:
+            np.random.shuffle(self.indices)
+
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+
+    def __getitem__(self, i):
+        # Sorted rows keep the reads within the memmaps in file order.
+        idx = np.sort(self.indices[i * self.batch_size:(i + 1) * self.batch_size])
+        return ((self.X_notes[idx], self.X_chords[idx]),
+                np.expand_dims(self.y_notes[idx], axis=-1))
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
 
 def main(args):
     ############################################################################
     # 1) Load or Build Dataset
     ############################################################################
-    DATASET_CACHE = "cached_dataset.npz"
-    
-    if not os.path.exists(DATASET_CACHE):
+    # One .npy per array so they can be memory-mapped instead of unzipped.
+    DATASET_CACHE = {name: f"cached_dataset_{name}.npy"
+                     for name in ("X_notes", "X_chords", "y_notes")}
+
+    if not all(os.path.exists(path) for path in DATASET_CACHE.values()):
         print("No cached dataset found. Building dataset from MIDI folder...")
         X_notes, X_chords, y_notes = build_training_dataset(
             MIDI_FOLDER,
@@ -37,14 +73,14 @@ def main(args):
         if X_notes is None:
             print("No data found. Exiting.")
             return
-        np.savez(DATASET_CACHE, X_notes=X_notes, X_chords=X_chords, y_notes=y_notes)
-        print(f"Dataset saved to {DATASET_CACHE}")
+        for name, arr in (("X_notes", X_notes), ("X_chords", X_chords), ("y_notes", y_notes)):
+            np.save(DATASET_CACHE[name], arr)
+        print(f"Dataset saved to {', '.join(DATASET_CACHE.values())}")
     else:
-        print(f"Loading dataset from cached file: {DATASET_CACHE}")
-        data = np.load(DATASET_CACHE)
-        X_notes  = data["X_notes"]
-        X_chords = data["X_chords"]
-        y_notes  = data["y_notes"]
+        print(f"Loading dataset from cached files: {', '.join(DATASET_CACHE.values())}")
+        X_notes  = np.load(DATASET_CACHE["X_notes"],  mmap_mode='r')
+        X_chords = np.load(DATASET_CACHE["X_chords"], mmap_mode='r')
+        y_notes  = np.load(DATASET_CACHE["y_notes"],  mmap_mode='r')
         print("Dataset loaded successfully.")
 
     print("Dataset shapes:")
@@ -52,6 +88,13 @@ def main(args):
     print("X_chords:", X_chords.shape) 
     print("y_notes:", y_notes.shape)
 
+    # Hold out the trailing windows for validation, as validation_split would.
+    n_train = int(len(X_notes) * (1.0 - VALIDATION_SPLIT))
+    train_batches = WindowBatches(X_notes, X_chords, y_notes,
+                                  np.arange(n_train), BATCH_SIZE, shuffle=True)
+    val_batches = WindowBatches(X_notes, X_chords, y_notes,
+                                np.arange(n_train, len(X_notes)), BATCH_SIZE)
+
     ############################################################################
     # 2) Train or Load the Unrolled Model Weights
     ############################################################################
@@ -70,14 +113,10 @@ def main(args):
             print("Force training enabled. Retraining model...")
         else:
             print("No trained weights found. Training unrolled LSTM model...")
-        y_notes_expanded = np.expand_dims(y_notes, axis=-1)
-        
         unrolled_model.fit(
-            [X_notes, X_chords],
-            y_notes_expanded,
-            batch_size=BATCH_SIZE,
+            train_batches,
             epochs=EPOCHS,
-            validation_split=0.1
+            validation_data=val_batches
         )
         # Save weights
         unrolled_model.save_weights(WEIGHTS_PATH)
@@ -100,6 +139,19 @@ def main(args):
         except:
             print(f"Skipping layer '{lname}'")
 
+    ############################################################################
+    # 4) Export Quantized Single-Step Model for Real-Time Inference
+    ############################################################################
+    TFLITE_PATH = "./saved_models/rt_int8.tflite"
+
+    # The converter snapshots the LSTM state variables, so start from zeros.
+    rt_model.get_layer("lstm").reset_states()
+    tflite_model = convert_single_step_to_tflite(
+        rt_model, optimizations=[tf.lite.Optimize.DEFAULT])
+    with open(TFLITE_PATH, "wb") as f:
+        f.write(tflite_model)
+    print(f"Saved int8 real-time model to {TFLITE_PATH}")
+
 
 
 if __name__ == "__main__":